@@ -0,0 +1,106 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+# the tools are one script at the top of the repository
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+# raw ICMP sockets are only open to root
+needsRoot = pytest.mark.skipif(os.geteuid() != 0, reason='raw sockets need root')
+
+
+def freePort():
+    with socket.socket() as probe:
+        probe.bind(('localhost', 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture
+def launch():
+    # launch(subcommand, *options) runs the script as a server and returns its
+    # port once it accepts connections; launch.stop(port) interrupts it,
+    # launch.processes maps ports to processes, and every server still running
+    # is interrupted afterwards
+    processes = {}
+
+    def start(*args, port=None, cwd=None):
+        port = port or freePort()
+        process = subprocess.Popen([sys.executable, os.path.join(root, 'NetworkApplications.py')]
+                                   + [str(arg) for arg in args] + ['--port', str(port)],
+                                   cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        processes[port] = process
+        deadline = time.time() + 10
+        while True:
+            try:
+                socket.create_connection(('localhost', port), timeout=1).close()
+                return port
+            except OSError:
+                if process.poll() is not None or time.time() > deadline:
+                    raise RuntimeError('%s did not start' % (args[0]))
+                time.sleep(0.05)
+
+    def stop(port):
+        process = processes.pop(port)
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    start.stop = stop
+    start.processes = processes
+    yield start
+    for port in list(processes):
+        stop(port)
+
+
+def readResponse(stream, head=False):
+    # (status, headers, body) of the next response on a file made from a socket
+    status = stream.readline()
+    if not status:
+        return None
+    headers = {}
+    while True:
+        line = stream.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('iso-8859-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if head or int(status.split()[1]) in (204, 304):
+        body = b''
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = b''
+        while True:
+            size = int(stream.readline().split(b';')[0], 16)
+            body += stream.read(size)
+            stream.readline()
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        body = stream.read(int(headers['content-length']))
+    else:
+        body = stream.read()
+    return int(status.split()[1]), headers, body
+
+
+def children(pid):
+    # pids of the live processes whose parent is pid
+    found = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % (entry)) as fin:
+                fields = fin.read().rpartition(')')[2].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid and fields[0] != 'Z':
+            found.append(int(entry))
+    return found
@@ -0,0 +1,46 @@
+import random
+import struct
+
+import pytest
+
+from NetworkApplications import NetworkApplication
+
+
+app = NetworkApplication()
+
+
+@pytest.mark.parametrize('length', [0, 1, 2, 3, 8, 9, 64, 65, 1500, 4096, 4097, 9001])
+def test_checksum_matches_reference(length):
+    data = bytes(random.Random(length).getrandbits(8) for i in range(length))
+    assert app.checksum(data) == app.checksumReference(data)
+
+
+def test_checksum_of_echo_request():
+    header = struct.pack("bbHHh", 8, 0, 0, 0x1234, 1)
+    packet = header + b'abcdefghij'
+    checksum = app.checksum(packet)
+    assert checksum == app.checksumReference(packet)
+    # a packet carrying its own checksum sums to zero
+    assert app.checksum(struct.pack("bbHHh", 8, 0, checksum, 0x1234, 1) + b'abcdefghij') == 0
+
+
+def test_checksum_accepts_buffers():
+    data = bytearray(range(256)) * 3
+    assert app.checksum(memoryview(data)) == app.checksum(bytes(data))
+
+
+def test_checksum_update_matches_full_checksum():
+    rand = random.Random(1)
+    for i in range(200):
+        words = [rand.getrandbits(16) for i in range(16)]
+        checksum = app.checksum(struct.pack("16H", *words))
+        index = rand.randrange(16)
+        old, words[index] = words[index], rand.getrandbits(16)
+        assert app.checksumUpdate(checksum, old, words[index]) == app.checksum(struct.pack("16H", *words))
+
+
+@pytest.mark.parametrize('old,new', [(0x0000, 0xffff), (0xffff, 0x0000), (0x1234, 0x1234)])
+def test_checksum_update_edge_words(old, new):
+    words = [old, 0x8000, 0x7fff, 0x0001]
+    checksum = app.checksum(struct.pack("4H", *words))
+    assert app.checksumUpdate(checksum, old, new) == app.checksum(struct.pack("4H", new, *words[1:]))
@@ -0,0 +1,151 @@
+import pytest
+
+from NetworkApplications import HeaderTooLarge, HTTPParser
+
+
+def feedAll(parser, data, size):
+    # feeds data in pieces of size bytes, collecting every complete message
+    messages = []
+    for start in range(0, len(data), size):
+        parser.feed(data[start:start + size])
+        while True:
+            message = parser.next()
+            if message is None:
+                break
+            messages.append(message)
+    return messages
+
+
+request = (b'POST /form?x=1 HTTP/1.1\r\nHost: example.com\r\nContent-Length: 11\r\n'
+           b'X-Repeated: a\r\nX-Repeated: b\r\n\r\nhello world')
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, len(request)])
+def test_incremental_feeds(size):
+    parser = HTTPParser()
+    messages = feedAll(parser, request, size)
+    assert len(messages) == 1
+    message = messages[0]
+    assert (message.method, message.target, message.version) == ('POST', '/form?x=1', 'HTTP/1.1')
+    assert message.header('host') == 'example.com'
+    assert message.header('x-repeated') == 'a, b'
+    assert bytes(message.body) == b'hello world'
+    assert parser.buffer == b''
+
+
+def test_head_complete_only_once_the_blank_line_arrives():
+    parser = HTTPParser()
+    for piece in (b'GET / HTTP/1.1\r\n', b'Host: x\r\n', b'\r'):
+        parser.feed(piece)
+        assert not parser.headComplete()
+        assert parser.nextHead() is None
+    parser.feed(b'\n')
+    assert parser.headComplete()
+    assert parser.nextHead().target == '/'
+
+
+chunked = (b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+           b'5;name=value\r\nhello\r\n1\r\n \r\n5\r\nworld\r\n0\r\nX-Trailer: yes\r\n\r\n')
+
+
+@pytest.mark.parametrize('size', [1, 5, len(chunked)])
+def test_chunked_body(size):
+    parser = HTTPParser(response=True)
+    messages = feedAll(parser, chunked + b'HTTP/1.1 204 No Content\r\n\r\n', size)
+    assert [message.status for message in messages] == [200, 204]
+    assert messages[0].chunked
+    assert bytes(messages[0].body) == b'hello world'
+    assert bytes(messages[1].body) == b''
+
+
+def test_pipelined_requests():
+    parser = HTTPParser()
+    data = (b'\r\nGET /a HTTP/1.1\r\nHost: x\r\n\r\n'
+            b'POST /b HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nabc\r\n0\r\n\r\n'
+            b'HEAD /c HTTP/1.0\r\n\r\nGET /d HT')
+    messages = feedAll(parser, data, len(data))
+    assert [message.target for message in messages] == ['/a', '/b', '/c']
+    assert bytes(messages[1].body) == b'abc'
+    assert [message.keepAlive() for message in messages] == [True, True, False]
+    # the start of the next request waits in the buffer
+    assert parser.buffer == b'GET /d HT'
+    parser.feed(b'TP/1.1\r\n\r\n')
+    assert parser.next().target == '/d'
+
+
+def test_response_framing():
+    # no length: the body runs until the connection closes
+    parser = HTTPParser(response=True)
+    parser.feed(b'HTTP/1.0 200 OK\r\n\r\nuntil')
+    assert parser.next() is None
+    parser.feed(b' close')
+    parser.feed(b'')
+    assert bytes(parser.next().body) == b'until close'
+    # the answer to HEAD has no body whatever its Content-Length says
+    parser = HTTPParser(response=True)
+    parser.feed(b'HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\nHTTP/1.1 304 Not Modified\r\n\r\n')
+    assert parser.next('HEAD').length == 0
+    assert parser.next('GET').status == 304
+
+
+def test_body_cut_short():
+    parser = HTTPParser()
+    parser.feed(b'POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\nshort')
+    assert parser.next() is None
+    parser.feed(b'')
+    with pytest.raises(ConnectionError):
+        parser.next()
+
+
+@pytest.mark.parametrize('data', [
+    b'GET /\r\n\r\n',
+    b'GET / HTTP/1.1\r\nno colon\r\n\r\n',
+    b'GET / HTTP/1.1\r\nName : value\r\n\r\n',
+    b'POST / HTTP/1.1\r\nContent-Length: 3\r\nContent-Length: 4\r\n\r\n',
+    b'POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n',
+])
+def test_malformed_requests(data):
+    parser = HTTPParser()
+    parser.feed(data)
+    with pytest.raises(ValueError):
+        parser.next()
+
+
+@pytest.mark.parametrize('size', [b'zz', b'-5', b'0x5', b'+5', b''])
+def test_malformed_chunk_size(size):
+    parser = HTTPParser()
+    parser.feed(b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n' + size + b'\r\nhello\r\n0\r\n\r\n')
+    with pytest.raises(ValueError):
+        parser.next()
+
+
+def test_malformed_status_line():
+    parser = HTTPParser(response=True)
+    parser.feed(b'HTTP/1.1 OK\r\n\r\n')
+    with pytest.raises(ValueError):
+        parser.next()
+
+
+def test_oversized_head_that_never_ends():
+    parser = HTTPParser(maxHeaderSize=1024)
+    parser.feed(b'GET / HTTP/1.1\r\n')
+    for i in range(100):
+        parser.feed(b'X-Filler: ' + b'a' * 100 + b'\r\n')
+        if len(parser.buffer) > 1024:
+            break
+        assert parser.nextHead() is None
+    with pytest.raises(HeaderTooLarge):
+        parser.nextHead()
+
+
+def test_oversized_head_in_one_piece():
+    parser = HTTPParser(maxHeaderSize=1024)
+    parser.feed(b'GET / HTTP/1.1\r\nX-Filler: ' + b'a' * 2000 + b'\r\n\r\n')
+    assert parser.headComplete()
+    with pytest.raises(HeaderTooLarge):
+        parser.nextHead()
+    # a head just within the limit is fine
+    parser = HTTPParser(maxHeaderSize=1024)
+    head = b'GET / HTTP/1.1\r\nX-Filler: '
+    parser.feed(head + b'a' * (1024 - len(head) - 4) + b'\r\n\r\n')
+    assert parser.nextHead().header('x-filler') == 'a' * (1024 - len(head) - 4)
@@ -0,0 +1,54 @@
+import os
+import re
+import subprocess
+import sys
+
+from conftest import needsRoot, root
+from NetworkApplications import PingEngine, PingStats, ProbeClock
+
+
+@needsRoot
+def test_sweep_loopback():
+    engine = PingEngine(timeout=1)
+    stats = [PingStats('localhost', '127.0.0.1'), PingStats('127.0.0.2', '127.0.0.2')]
+    try:
+        engine.sweep(stats, count=3, interval=0.01)
+    finally:
+        engine.close()
+    for stat in stats:
+        assert stat.sent == 3
+        assert stat.received == 3
+        assert stat.packetLoss() == 0.0
+        assert stat.minimum <= stat.average() <= stat.maximum < 1000
+
+
+@needsRoot
+def test_sweep_many_targets_share_the_window():
+    # more targets than the in-flight window still all get their probes
+    engine = PingEngine(timeout=1, inflight=4)
+    stats = [PingStats(address, address) for address in ('127.0.0.%d' % (i) for i in range(1, 21))]
+    try:
+        engine.sweep(stats, count=2, interval=0.01)
+    finally:
+        engine.close()
+    assert [stat.sent for stat in stats] == [2] * 20
+    assert [stat.received for stat in stats] == [2] * 20
+
+
+def test_round_trips_are_never_negative():
+    clock = ProbeClock()
+    clock.queued = 5000
+    # a kernel correction that lands before the send stamp is dropped
+    assert clock.elapsed(10000, 8000) == 0.003
+    assert clock.elapsed(10000, 12000) == 0.002
+    clock.queued = 0
+    assert clock.elapsed(10000, 9000) == 0.0
+
+
+@needsRoot
+def test_flood_summary():
+    output = subprocess.run([sys.executable, os.path.join(root, 'NetworkApplications.py'), 'ping', '127.0.0.1',
+                             '--flood', '-c', '500'], capture_output=True, text=True, timeout=60).stdout
+    assert '500 packets transmitted, 500 received' in output
+    minimum, average, maximum = map(float, re.search(r'rtt min/avg/max = (\S+)/(\S+)/(\S+) ms', output).groups())
+    assert 0 <= minimum <= average <= maximum
@@ -0,0 +1,157 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+from conftest import root
+from NetworkApplications import (BinarySink, HostResolver, NetworkApplication, PingEngine, PingStats, ResultReader,
+                                 ResultSink, SimulatedNetwork, TopologyStore, TraceEngine)
+
+
+# 198.18.3.2 is eight hops away in the default topology, past a two-way load
+# balancer at TTL 3 and a four-way one at TTL 5
+destination = '198.18.3.2'
+path = {1: {'10.0.1.1'}, 2: {'10.0.2.1'}, 3: {'10.0.3.1', '10.0.3.2'}, 4: {'10.0.4.1'},
+        5: {'10.0.5.1', '10.0.5.2', '10.0.5.3', '10.0.5.4'}, 6: {'10.0.6.1'}, 7: {'10.1.3.1'},
+        8: {destination}}
+# one way: 0.2 + 1 + 2 + 2 + 5 + 5 + 3 + 0.5 ms
+roundTrip = 37.4
+
+
+@pytest.fixture(autouse=True)
+def resolver():
+    # the engines start PTR lookups for every hop, each test gets its own resolver
+    NetworkApplication.resolver = HostResolver()
+    yield NetworkApplication.resolver
+    NetworkApplication.resolver.close()
+    NetworkApplication.resolver = None
+
+
+def network():
+    return SimulatedNetwork(SimulatedNetwork.defaultTopology())
+
+
+def addresses(replies):
+    return set(reply.address for reply in replies if reply is not None)
+
+
+def test_ping_sweep():
+    engine = PingEngine(timeout=1, transport=network())
+    targets = engine.transport.destinations[:32]
+    stats = [PingStats(address, address) for address in targets]
+    try:
+        engine.sweep(stats, count=3, interval=0.01)
+    finally:
+        engine.close()
+    for stat in stats:
+        assert stat.sent == 3
+        assert stat.received + stat.lost == 3
+        # only the link to edge router 0 drops anything
+        if not stat.address.startswith('198.18.0.'):
+            assert stat.received == 3
+        if stat.received:
+            assert roundTrip <= stat.minimum <= stat.maximum < roundTrip + 50
+
+
+@pytest.mark.parametrize('protocol,paris', [('icmp', False), ('icmp', True), ('udp', False), ('udp', True)])
+def test_trace(protocol, paris):
+    engine = TraceEngine(protocol, timeout=1, paris=paris, transport=network())
+    try:
+        hops = engine.trace(destination, maxHops=15)
+    finally:
+        engine.close()
+    # stops at the destination rather than going on to maxHops
+    assert [ttl for ttl, replies, cached in hops] == list(range(1, 9))
+    for ttl, replies, cached in hops:
+        assert not cached
+        assert None not in replies
+        assert addresses(replies) <= path[ttl]
+        assert all(reply.type == 11 for reply in replies) == (ttl < 8)
+        if paris:
+            # one flow identifier takes one branch of every load balancer
+            assert len(addresses(replies)) == 1
+
+
+@pytest.mark.parametrize('protocol', ['icmp', 'udp'])
+def test_mda_finds_every_branch(protocol):
+    output = subprocess.run([sys.executable, os.path.join(root, 'NetworkApplications.py'), 'pt', destination,
+                             '--simulate', '--mda', '-p', protocol, '-t', '1'],
+                            stdout=subprocess.PIPE, universal_newlines=True, timeout=120).stdout
+    found = {}
+    edges = {}
+    for ttl, address, links in re.findall(r'^(\d+) \S+ \((\S+)\) [\d.]+ ms  \d+/\d+ probes(?:  <- (.*))?$',
+                                          output, re.MULTILINE):
+        found.setdefault(int(ttl), set()).add(address)
+        edges[address] = set(links.split(', ')) if links else set()
+    assert found == path
+    # the diamonds: every branch hangs off the balancer and leads to where they meet
+    assert edges['10.0.3.1'] == edges['10.0.3.2'] == {'10.0.2.1'}
+    assert edges['10.0.4.1'] == {'10.0.3.1', '10.0.3.2'}
+    assert all(edges['10.0.5.%d' % (i)] == {'10.0.4.1'} for i in range(1, 5))
+    assert edges['10.0.6.1'] == path[5]
+    assert 'probes sent in total' in output
+
+
+@pytest.mark.parametrize('format', ['ndjson', 'binary'])
+def test_mda_records_keep_the_graph(format, tmp_path):
+    output = tmp_path / 'mda'
+    subprocess.run([sys.executable, os.path.join(root, 'NetworkApplications.py'), 'pt', destination,
+                    '--simulate', '--mda', '-t', '1', '--format', format, '-o', str(output)],
+                   stdout=subprocess.DEVNULL, timeout=120)
+    edges = {}
+    for target, ttl, addr, rtt, flags, prev in ResultReader(str(output)).records():
+        assert flags & ResultSink.MULTIPATH
+        if addr is not None and ttl > 1:
+            edges.setdefault(addr, set()).add(prev)
+    assert edges['10.0.4.1'] == {'10.0.3.1', '10.0.3.2'}
+    assert edges['10.0.6.1'] == path[5]
+
+
+def test_results_written_before_the_prev_column(tmp_path):
+    output = tmp_path / 'old.bin'
+    columns = [b'\x02\x03\x12\xc6', b'\x04', b'\x01\x04\x00\x0a', (5000).to_bytes(8, 'little'), b'\x00']
+    output.write_bytes(BinarySink.legacyMagic + (1).to_bytes(4, 'little') + b''.join(columns))
+    assert list(ResultReader(str(output)).records()) == [(destination, 4, '10.0.4.1', 5000, 0, None)]
+
+
+def test_incremental_trace():
+    engine = TraceEngine(timeout=1, transport=network())
+    store = TopologyStore()
+    try:
+        first = engine.incrementalTrace(destination, store, maxHops=15)
+        firstProbes = engine.sent
+        second = engine.incrementalTrace(destination, store, maxHops=15)
+        secondProbes = engine.sent - firstProbes
+    finally:
+        engine.close()
+    for hops in (first, second):
+        assert [ttl for ttl, replies, cached in hops] == list(range(1, 9))
+        for ttl, replies, cached in hops:
+            assert addresses(replies) and addresses(replies) <= path[ttl]
+        assert hops[-1][1][0].type != 11
+    assert not any(cached for ttl, replies, cached in first)
+    # the destination's distance is known, so the repeat probes far less
+    assert 0 < secondProbes < firstProbes
+
+
+def test_incremental_trace_reuses_shared_hops():
+    # a fixed flow takes the same branch at TTL 3 towards both destinations
+    engine = TraceEngine(timeout=1, paris=True, transport=network())
+    store = TopologyStore()
+    try:
+        engine.incrementalTrace(destination, store, maxHops=15)
+        firstProbes = engine.sent
+        hops = engine.incrementalTrace('198.18.4.2', store, maxHops=15)
+        secondProbes = engine.sent - firstProbes
+    finally:
+        engine.close()
+    assert [ttl for ttl, replies, cached in hops] == list(range(1, 9))
+    assert addresses(hops[-1][1]) == {'198.18.4.2'}
+    # the hops shared with the first path come from the store, not from probes
+    cached = [ttl for ttl, replies, cached in hops if cached]
+    assert cached and max(cached) < 4
+    for ttl in cached:
+        assert addresses(hops[ttl - 1][1]) <= path[ttl]
+    assert secondProbes < firstProbes
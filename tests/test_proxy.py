@@ -0,0 +1,387 @@
+import collections
+import concurrent.futures
+import http.server
+import json
+import os
+import resource
+import signal
+import socket
+import threading
+import time
+
+import pytest
+
+from conftest import freePort, readResponse
+
+
+class OriginHandler(http.server.BaseHTTPRequestHandler):
+
+    # answers from server.routes: path -> (status, headers, body, delay), where
+    # body can be a function of the request handler
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        http.server.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.hits[self.path] += 1
+        self.server.requests.append((self.path, dict((name.lower(), value) for name, value in self.headers.items())))
+        status, headers, body, delay = self.server.routes.get(self.path, (404, [], b'', 0))
+        time.sleep(delay)
+        if callable(body):
+            body = body(self)
+        etag = dict(headers).get('ETag')
+        if etag is not None and self.headers.get('If-None-Match') == etag:
+            status, body = 304, b''
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        chunked = ('Transfer-Encoding', 'chunked') in headers
+        if status != 304 and not chunked:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not chunked:
+            self.wfile.write(body)
+            return
+        for start in range(0, len(body), 65536):
+            chunk = body[start:start + 65536]
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def do_POST(self):
+        # echoes the request body back
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+                if size == 0:
+                    break
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests.append((self.path, dict((name.lower(), value) for name, value in self.headers.items())))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    server = http.server.ThreadingHTTPServer(('localhost', 0), OriginHandler)
+    server.daemon_threads = True
+    server.routes = {}
+    server.hits = collections.Counter()
+    server.requests = []
+    server.connections = 0
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    server.url = 'http://localhost:%d' % (server.server_address[1])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def proxyGet(port, url, headers=b''):
+    # one request through the proxy on a connection of its own
+    connection = socket.create_connection(('localhost', port), timeout=10)
+    with connection:
+        connection.sendall(b'GET %s HTTP/1.1\r\nHost: x\r\n%sConnection: close\r\n\r\n' % (url.encode(), headers))
+        return readResponse(connection.makefile('rb'))
+
+
+def test_hit_after_miss(launch, origin):
+    origin.routes['/page'] = (200, [('Cache-Control', 'max-age=60')], b'page body', 0)
+    port = launch('proxy')
+    first = proxyGet(port, origin.url + '/page')
+    second = proxyGet(port, origin.url + '/page')
+    assert first[0] == second[0] == 200
+    assert first[2] == second[2] == b'page body'
+    assert (first[1]['x-cache'], second[1]['x-cache']) == ('MISS', 'HIT')
+    assert origin.hits['/page'] == 1
+
+
+@pytest.mark.parametrize('cacheControl', ['no-store', 'private, max-age=60'])
+def test_uncacheable_responses(launch, origin, cacheControl):
+    origin.routes['/page'] = (200, [('Cache-Control', cacheControl)], b'page body', 0)
+    port = launch('proxy')
+    for i in range(2):
+        status, headers, body = proxyGet(port, origin.url + '/page')
+        assert (status, body, headers['x-cache']) == (200, b'page body', 'MISS')
+    assert origin.hits['/page'] == 2
+
+
+def test_request_no_store_bypasses_the_cache(launch, origin):
+    origin.routes['/page'] = (200, [('Cache-Control', 'max-age=60')], b'page body', 0)
+    port = launch('proxy')
+    assert proxyGet(port, origin.url + '/page', b'Cache-Control: no-store\r\n')[1]['x-cache'] == 'BYPASS'
+    assert proxyGet(port, origin.url + '/page')[1]['x-cache'] == 'MISS'
+
+
+def test_vary(launch, origin):
+    language = lambda handler: handler.headers.get('Accept-Language', 'none').encode()
+    origin.routes['/page'] = (200, [('Cache-Control', 'max-age=60'), ('Vary', 'Accept-Language')], language, 0)
+    port = launch('proxy')
+    assert proxyGet(port, origin.url + '/page', b'Accept-Language: en\r\n')[2] == b'en'
+    assert proxyGet(port, origin.url + '/page', b'Accept-Language: fr\r\n')[2] == b'fr'
+    status, headers, body = proxyGet(port, origin.url + '/page', b'Accept-Language: en\r\n')
+    assert (body, headers['x-cache']) == (b'en', 'HIT')
+    assert origin.hits['/page'] == 2
+
+
+def test_revalidation(launch, origin):
+    origin.routes['/page'] = (200, [('Cache-Control', 'no-cache'), ('ETag', '"v1"')], b'page body', 0)
+    port = launch('proxy')
+    assert proxyGet(port, origin.url + '/page')[1]['x-cache'] == 'MISS'
+    status, headers, body = proxyGet(port, origin.url + '/page')
+    assert (status, body, headers['x-cache']) == (200, b'page body', 'REVALIDATED')
+    assert origin.requests[-1][1]['if-none-match'] == '"v1"'
+
+
+def test_back_to_back_revalidations(launch, origin):
+    # a new request must not wait on the fetch that has just been answered
+    origin.routes['/page'] = (200, [('Cache-Control', 'no-cache'), ('ETag', '"v1"')], b'page body', 0)
+    port = launch('proxy')
+    for i in range(50):
+        status, headers, body = proxyGet(port, origin.url + '/page')
+        assert (status, body, headers['x-cache']) == (200, b'page body', 'REVALIDATED' if i else 'MISS')
+
+
+def test_concurrent_misses_are_coalesced(launch, origin):
+    origin.routes['/slow'] = (200, [('Cache-Control', 'max-age=60')], b'slow body', 0.5)
+    port = launch('proxy')
+    with concurrent.futures.ThreadPoolExecutor(5) as pool:
+        responses = list(pool.map(lambda i: proxyGet(port, origin.url + '/slow'), range(5)))
+    assert [response[2] for response in responses] == [b'slow body'] * 5
+    assert origin.hits['/slow'] == 1
+
+
+def test_requests_with_credentials(launch, origin):
+    user = lambda handler: handler.headers.get('Authorization', 'anonymous').encode()
+    origin.routes['/private'] = (200, [('Cache-Control', 'max-age=60')], user, 0.3)
+    origin.routes['/public'] = (200, [('Cache-Control', 'public, max-age=60')], user, 0)
+    port = launch('proxy')
+    # neither stored nor shared with the anonymous request running alongside it
+    with concurrent.futures.ThreadPoolExecutor(2) as pool:
+        alice = pool.submit(proxyGet, port, origin.url + '/private', b'Authorization: alice\r\n')
+        time.sleep(0.1)
+        anonymous = pool.submit(proxyGet, port, origin.url + '/private')
+        assert (alice.result()[2], alice.result()[1]['x-cache']) == (b'alice', 'MISS')
+        assert (anonymous.result()[2], anonymous.result()[1]['x-cache']) == (b'anonymous', 'MISS')
+    status, headers, body = proxyGet(port, origin.url + '/private', b'Authorization: bob\r\n')
+    assert (body, headers['x-cache']) == (b'bob', 'MISS')
+    status, headers, body = proxyGet(port, origin.url + '/private')
+    assert (body, headers['x-cache']) == (b'anonymous', 'HIT')
+    # an explicitly public response may be stored and served to others
+    assert proxyGet(port, origin.url + '/public', b'Authorization: alice\r\n')[1]['x-cache'] == 'MISS'
+    status, headers, body = proxyGet(port, origin.url + '/public')
+    assert (body, headers['x-cache']) == (b'alice', 'HIT')
+
+
+def test_disk_tier_survives_a_restart(launch, origin, tmp_path):
+    origin.routes['/page'] = (200, [('Cache-Control', 'max-age=60')], b'page body', 0)
+    port = launch('proxy', '--cache-dir', tmp_path / 'cache')
+    assert proxyGet(port, origin.url + '/page')[1]['x-cache'] == 'MISS'
+    launch.stop(port)
+    port = launch('proxy', '--cache-dir', tmp_path / 'cache')
+    status, headers, body = proxyGet(port, origin.url + '/page')
+    assert (body, headers['x-cache']) == (b'page body', 'HIT')
+    assert origin.hits['/page'] == 1
+
+
+def test_cache_stats(launch, origin):
+    origin.routes['/page'] = (200, [('Cache-Control', 'max-age=60')], b'page body', 0)
+    port = launch('proxy')
+    proxyGet(port, origin.url + '/page')
+    proxyGet(port, origin.url + '/page')
+    stats = json.loads(proxyGet(port, '/cache-stats')[2])
+    assert stats['hits'] == 1 and stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+
+
+def test_oversized_head_is_refused(launch, origin):
+    port = launch('proxy')
+    status, headers, body = proxyGet(port, origin.url + '/page', b'X-Filler: ' + b'a' * 70000 + b'\r\n')
+    assert status == 431
+    # refused by the proxy itself, not passed on for the origin to refuse
+    assert origin.connections == 0
+
+
+def test_upstream_connections_are_reused(launch, origin):
+    for path in ('/a', '/b', '/c'):
+        origin.routes[path] = (200, [('Cache-Control', 'no-store')], path.encode(), 0)
+    port = launch('proxy')
+    for path in ('/a', '/b', '/c', '/a'):
+        assert proxyGet(port, origin.url + path)[2] == path.encode()
+    assert origin.connections == 1
+
+
+def test_origin_closing_its_connection(launch, origin):
+    origin.routes['/close'] = (200, [('Cache-Control', 'no-store'), ('Connection', 'close')], b'closing', 0)
+    port = launch('proxy')
+    for i in range(3):
+        assert proxyGet(port, origin.url + '/close')[2] == b'closing'
+    assert origin.connections == 3
+
+
+def test_client_keep_alive(launch, origin):
+    origin.routes['/page'] = (200, [('Cache-Control', 'max-age=60')], b'page body', 0)
+    port = launch('proxy')
+    connection = socket.create_connection(('localhost', port), timeout=10)
+    stream = connection.makefile('rb')
+    with connection:
+        for cacheStatus in ('MISS', 'HIT'):
+            connection.sendall(b'GET %s/page HTTP/1.1\r\nHost: x\r\n\r\n' % (origin.url.encode()))
+            status, headers, body = readResponse(stream)
+            assert (status, body, headers['x-cache']) == (200, b'page body', cacheStatus)
+            assert headers['connection'] == 'keep-alive'
+        connection.sendall(b'GET %s/page HTTP/1.0\r\n\r\n' % (origin.url.encode()))
+        status, headers, body = readResponse(stream)
+        assert headers['connection'] == 'close'
+        assert stream.read() == b''
+
+
+@pytest.mark.parametrize('overload', ['reject', 'pause'])
+def test_saturated_proxy(launch, origin, overload):
+    origin.routes['/slow'] = (200, [('Cache-Control', 'no-store')], b'slow body', 1.0)
+    port = launch('proxy', '--threads', 1, '--queue', 0, '--overload', overload)
+
+    def occupy():
+        # the connection that checked the proxy was up may still hold the worker
+        while True:
+            response = proxyGet(port, origin.url + '/slow')
+            if response[0] != 503:
+                return response
+            time.sleep(0.05)
+
+    with concurrent.futures.ThreadPoolExecutor(1) as pool:
+        first = pool.submit(occupy)
+        while not origin.hits['/slow']:
+            time.sleep(0.01)
+        startTime = time.time()
+        status, headers, body = proxyGet(port, origin.url + '/slow')
+        waited = time.time() - startTime
+        assert first.result()[2] == b'slow body'
+    if overload == 'reject':
+        # answered at once instead of queueing
+        assert status == 503 and headers['retry-after'] == '1'
+        assert waited < 0.5
+    else:
+        # held in the backlog until the worker was free
+        assert (status, body) == (200, b'slow body')
+        assert waited > 0.5
+
+
+@pytest.mark.parametrize('overload', ['reject', 'pause'])
+def test_out_of_file_descriptors(launch, origin, overload):
+    origin.routes['/page'] = (200, [('Cache-Control', 'no-store')], b'page body', 0)
+    port = launch('proxy', '--threads', 2, '--queue', 0, '--overload', overload)
+    pid = launch.processes[port].pid
+    limits = resource.prlimit(pid, resource.RLIMIT_NOFILE)
+    # no descriptor left for the next client: accept fails with EMFILE
+    opened = len(os.listdir('/proc/%d/fd' % (pid)))
+    resource.prlimit(pid, resource.RLIMIT_NOFILE, (opened, limits[1]))
+    with concurrent.futures.ThreadPoolExecutor(2) as pool:
+        waiting = [pool.submit(proxyGet, port, origin.url + '/page') for i in range(2)]
+        time.sleep(0.5)
+        resource.prlimit(pid, resource.RLIMIT_NOFILE, limits)
+        # the clients are served once descriptors are back, and no slot was lost
+        assert [response.result()[2] for response in waiting] == [b'page body'] * 2
+    assert launch.processes[port].poll() is None
+    assert proxyGet(port, origin.url + '/page')[2] == b'page body'
+
+
+def test_upstream_timeout(launch, origin):
+    origin.routes['/stalled'] = (200, [('Cache-Control', 'no-store')], b'late', 3)
+    port = launch('proxy', '--upstream-timeout', 1)
+    assert proxyGet(port, origin.url + '/stalled')[0] == 504
+
+
+def test_unreachable_origin(launch):
+    port = launch('proxy')
+    assert proxyGet(port, 'http://localhost:%d/' % (freePort()))[0] == 502
+
+
+@pytest.mark.parametrize('chunked', [False, True])
+def test_request_bodies_are_forwarded(launch, origin, chunked):
+    body = os.urandom(3 << 20)
+    port = launch('proxy')
+    connection = socket.create_connection(('localhost', port), timeout=10)
+    with connection:
+        if chunked:
+            framing = b'Transfer-Encoding: chunked\r\n'
+            data = b''.join(b'%x\r\n%s\r\n' % (len(body[i:i + 100000]), body[i:i + 100000])
+                            for i in range(0, len(body), 100000)) + b'0\r\n\r\n'
+        else:
+            framing = b'Content-Length: %d\r\n' % (len(body))
+            data = body
+        connection.sendall(b'POST %s/echo HTTP/1.1\r\nHost: x\r\n%sConnection: close\r\n\r\n'
+                           % (origin.url.encode(), framing) + data)
+        status, headers, echoed = readResponse(connection.makefile('rb'))
+    assert status == 200
+    assert echoed == body
+
+
+@pytest.mark.parametrize('framing', [[('Cache-Control', 'max-age=60')],
+                                     [('Cache-Control', 'max-age=60'), ('Transfer-Encoding', 'chunked')]])
+def test_large_responses_are_streamed(launch, origin, framing):
+    # larger than the cache takes, so relayed as it arrives
+    body = os.urandom(3 << 20)
+    origin.routes['/large'] = (200, framing, body, 0)
+    port = launch('proxy', '--cache-object', 1)
+    for i in range(2):
+        status, headers, received = proxyGet(port, origin.url + '/large')
+        assert (status, received == body) == (200, True)
+    assert origin.hits['/large'] == 2
+
+
+def test_connect_tunnel(launch):
+    listener = socket.socket()
+    listener.bind(('localhost', 0))
+    listener.listen(1)
+
+    def echo():
+        connection, address = listener.accept()
+        with connection:
+            while True:
+                data = connection.recv(65536)
+                if not data:
+                    return
+                connection.sendall(data)
+
+    thread = threading.Thread(target=echo, daemon=True)
+    thread.start()
+    port = launch('proxy')
+    connection = socket.create_connection(('localhost', port), timeout=10)
+    with connection, listener:
+        connection.sendall(b'CONNECT localhost:%d HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                           % (listener.getsockname()[1]))
+        stream = connection.makefile('rb')
+        assert stream.readline().split()[1] == b'200'
+        while stream.readline() != b'\r\n':
+            pass
+        message = os.urandom(200000)
+        connection.sendall(message)
+        assert stream.read(len(message)) == message
+
+
+def test_workers_drain_on_sigterm(launch, origin):
+    origin.routes['/slow'] = (200, [('Cache-Control', 'no-store')], b'slow body', 1.0)
+    port = launch('proxy', '--workers', 2, '--drain', 5)
+    supervisor = launch.processes[port]
+    with concurrent.futures.ThreadPoolExecutor(1) as pool:
+        pending = pool.submit(proxyGet, port, origin.url + '/slow')
+        while not origin.hits['/slow']:
+            time.sleep(0.01)
+        supervisor.send_signal(signal.SIGTERM)
+        # the request in flight is finished, then everything exits
+        assert pending.result()[:3:2] == (200, b'slow body')
+    assert supervisor.wait(5) == 0
+    with pytest.raises(OSError):
+        socket.create_connection(('localhost', port), timeout=1)
@@ -0,0 +1,103 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+from conftest import needsRoot, root
+from NetworkApplications import ICMPReply, ParisTraceroute, SimulatedNetwork, TraceEngine
+
+
+@needsRoot
+@pytest.mark.parametrize('protocol,paris', [('icmp', False), ('icmp', True), ('udp', False), ('udp', True)])
+def test_trace_loopback(protocol, paris):
+    engine = TraceEngine(protocol, timeout=1, paris=paris)
+    try:
+        hops = engine.trace('127.0.0.1', maxHops=5)
+    finally:
+        engine.close()
+    # the destination answers the first TTL and nothing further is reported
+    assert [hop[0] for hop in hops] == [1]
+    replies = hops[0][1]
+    assert len(replies) == 3
+    # every probe is answered and matched to itself, none is charged to another
+    assert None not in replies
+    for reply in replies:
+        assert reply.address == '127.0.0.1'
+        assert reply.rtt >= 0
+        assert reply.type == (0 if protocol == 'icmp' else 3)
+
+
+@needsRoot
+def test_paris_udp_traces_in_a_row():
+    # a connected flow socket reports each port unreachable on its next send
+    engine = TraceEngine('udp', timeout=1, paris=True)
+    try:
+        for i in range(5):
+            hops = engine.trace('127.0.0.1', maxHops=5)
+            assert [hop[0] for hop in hops] == [1]
+            assert None not in hops[0][1]
+    finally:
+        engine.close()
+
+
+def test_paris_udp_reply_matching():
+    engine = TraceEngine('udp', timeout=1, paris=True, transport=SimulatedNetwork(SimulatedNetwork.defaultTopology()))
+    dest = '198.18.3.2'
+    probes = [(1, 0), (2, 0), (1, 1)]
+    outstanding = {}
+    for index, (ttl, flow) in enumerate(probes):
+        key = index + 1
+        outstanding[key] = (index, engine.sendProbe(dest, ttl, flow, key))
+    port = lambda flow: engine.transport.udpSource(None, flow)[1]
+    reply = lambda checksum, sourcePort, quotedTtl: ICMPReply(3, 3, 64, 17, 0, 0, dest, TraceEngine.basePort,
+                                                              checksum, sourcePort, quotedTtl)
+    # the checksum names the probe, as long as the ports agree
+    assert engine.replyKey(reply(2, port(0), 1), dest, probes, outstanding) == 2
+    assert engine.replyKey(reply(2, port(1), 1), dest, probes, outstanding) == 3
+    # a partial checksum: the ports and the quoted TTL name flow and hop
+    assert engine.replyKey(reply(0xbeef, port(0), 2), dest, probes, outstanding) == 2
+    assert engine.replyKey(reply(0xbeef, port(1), 1), dest, probes, outstanding) == 3
+    # nothing fits: dropped instead of charged to some probe
+    assert engine.replyKey(reply(0xbeef, port(1), 2), dest, probes, outstanding) is None
+    assert engine.replyKey(reply(0xbeef, 9, 1), dest, probes, outstanding) is None
+
+
+@needsRoot
+def test_trace_queries():
+    engine = TraceEngine('icmp', timeout=1)
+    try:
+        hops = engine.trace('127.0.0.1', maxHops=3, queries=5)
+    finally:
+        engine.close()
+    assert len(hops[0][1]) == 5
+    assert None not in hops[0][1]
+
+
+def test_mda_stopping_points():
+    # the 95% confidence column of the MDA table (Veitch et al.)
+    mda = ParisTraceroute.__new__(ParisTraceroute)
+    mda.args = argparse.Namespace(confidence=0.95)
+    assert [mda.stoppingPoint(k) for k in range(1, 6)] == [6, 11, 16, 21, 27]
+
+
+@needsRoot
+@pytest.mark.parametrize('protocol', ['icmp', 'udp'])
+def test_mda_loopback(protocol):
+    output = subprocess.run([sys.executable, os.path.join(root, 'NetworkApplications.py'), 'pt', '127.0.0.1',
+                             '--mda', '-p', protocol, '-t', '1'],
+                            stdout=subprocess.PIPE, universal_newlines=True, timeout=60).stdout
+    # one interface at the first TTL, probed until the stopping rule is met
+    hops = re.findall(r'(\d+) \S+ \((\S+)\) [\d.]+ ms  (\d+)/(\d+) probes', output)
+    assert hops == [('1', '127.0.0.1', '6', '6')]
+    assert '6 probes sent in total (13 for a fixed 13 probes per hop)' in output
+
+
+def test_mda_without_hops():
+    result = subprocess.run([sys.executable, os.path.join(root, 'NetworkApplications.py'), 'pt', '198.18.3.2',
+                             '--simulate', '--mda', '--max-hops', '0'],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert '0 probes sent in total (0 for a fixed 13 probes per hop)' in result.stdout
@@ -0,0 +1,219 @@
+import concurrent.futures
+import os
+import signal
+import socket
+import time
+
+import pytest
+
+from conftest import children, readResponse
+
+
+def connect(port):
+    connection = socket.create_connection(('localhost', port), timeout=10)
+    return connection, connection.makefile('rb')
+
+
+def test_pipelined_requests_share_a_connection(launch):
+    port = launch('web')
+    connection, stream = connect(port)
+    with connection:
+        connection.sendall(b'GET /missing-1 HTTP/1.1\r\nHost: x\r\n\r\nGET /missing-2 HTTP/1.1\r\nHost: x\r\n\r\n')
+        first = readResponse(stream)
+        second = readResponse(stream)
+        assert first[0] == second[0] == 404
+        assert first[1]['connection'] == 'keep-alive'
+        # still open for a request sent later
+        connection.sendall(b'HEAD /missing-3 HTTP/1.1\r\nHost: x\r\n\r\n')
+        assert readResponse(stream, head=True)[0] == 404
+
+
+def test_http10_closes_the_connection(launch):
+    port = launch('web')
+    connection, stream = connect(port)
+    with connection:
+        connection.sendall(b'GET /missing HTTP/1.0\r\n\r\n')
+        status, headers, body = readResponse(stream)
+        assert status == 404
+        assert headers['connection'] == 'close'
+        assert stream.read() == b''
+
+
+def test_request_body_is_skipped(launch):
+    port = launch('web')
+    connection, stream = connect(port)
+    with connection:
+        connection.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\n\r\nhello'
+                           b'GET /missing HTTP/1.1\r\nHost: x\r\n\r\n')
+        assert readResponse(stream)[0] == 405
+        assert readResponse(stream)[0] == 404
+
+
+def test_malformed_chunked_body(launch):
+    port = launch('web')
+    connection, stream = connect(port)
+    with connection:
+        connection.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n')
+        status, headers, body = readResponse(stream)
+        assert (status, headers['connection']) == (400, 'close')
+
+
+def test_oversized_head_is_refused(launch):
+    port = launch('web')
+    connection, stream = connect(port)
+    with connection:
+        connection.sendall(b'GET / HTTP/1.1\r\n' + b'X-Filler: ' + b'a' * 70000 + b'\r\n')
+        assert readResponse(stream)[0] == 431
+
+
+def test_oversized_complete_head_is_refused(launch):
+    # the whole head in one segment, blank line included
+    port = launch('web')
+    connection, stream = connect(port)
+    with connection:
+        connection.sendall(b'GET / HTTP/1.1\r\n' + b'X-Filler: ' + b'a' * 70000 + b'\r\n\r\n')
+        assert readResponse(stream)[0] == 431
+
+
+def test_concurrent_connections(launch):
+    port = launch('web', '--threads', 4)
+
+    def fetch(index):
+        connection, stream = connect(port)
+        with connection:
+            connection.sendall(b'GET /missing-%d HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n' % (index))
+            return readResponse(stream)[0]
+
+    # idle connections are held by the event loop, not by one of the 4 threads
+    idle = [socket.create_connection(('localhost', port)) for i in range(20)]
+    try:
+        with concurrent.futures.ThreadPoolExecutor(32) as pool:
+            assert list(pool.map(fetch, range(100))) == [404] * 100
+    finally:
+        for connection in idle:
+            connection.close()
+
+
+@pytest.fixture
+def site(tmp_path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    (root / 'index.html').write_bytes(b'<h1>index</h1>')
+    (root / 'a b.txt').write_bytes(b'spaced')
+    (root / 'big.bin').write_bytes(os.urandom(3 << 20))
+    (tmp_path / 'secret.txt').write_bytes(b'secret')
+    os.symlink(str(tmp_path / 'secret.txt'), str(root / 'link.txt'))
+    return root
+
+
+def get(port, path, method='GET', headers=b''):
+    connection, stream = connect(port)
+    with connection:
+        connection.sendall(b'%s %s HTTP/1.1\r\nHost: x\r\n%sConnection: close\r\n\r\n'
+                           % (method.encode(), path.encode(), headers))
+        return readResponse(stream, head=method == 'HEAD')
+
+
+def test_document_root(launch, site):
+    port = launch('web', '--root', site)
+    status, headers, body = get(port, '/')
+    assert (status, body) == (200, b'<h1>index</h1>')
+    assert headers['content-type'].startswith('text/html')
+    assert get(port, '/a%20b.txt')[2] == b'spaced'
+    assert get(port, '/nothing-here')[0] == 404
+
+
+def test_paths_outside_the_root_are_not_served(launch, site):
+    port = launch('web', '--root', site)
+    for path in ('/../secret.txt', '/%2e%2e/secret.txt', '/link.txt'):
+        status, headers, body = get(port, path)
+        assert status == 404
+        assert body != b'secret'
+
+
+def test_invalid_paths(launch, site):
+    port = launch('web', '--root', site)
+    for path in ('/%00', '/index.html%00.txt', '/%00/../secret.txt'):
+        assert get(port, path)[0] == 400
+    # a bad request does not take the connection's server down with it
+    assert get(port, '/')[0] == 200
+
+
+def test_large_file(launch, site):
+    port = launch('web', '--root', site, '--cache-file-size', 256)
+    status, headers, body = get(port, '/big.bin')
+    assert status == 200
+    assert body == (site / 'big.bin').read_bytes()
+    status, headers, body = get(port, '/big.bin', 'HEAD')
+    assert int(headers['content-length']) == 3 << 20 and body == b''
+
+
+def test_cached_file_follows_changes(launch, site):
+    port = launch('web', '--root', site)
+    assert get(port, '/a%20b.txt')[2] == b'spaced'
+    assert get(port, '/a%20b.txt')[2] == b'spaced'
+    path = str(site / 'a b.txt')
+    with open(path, 'wb') as fout:
+        fout.write(b'changed')
+    stamp = os.stat(path).st_mtime + 5
+    os.utime(path, (stamp, stamp))
+    assert get(port, '/a%20b.txt')[2] == b'changed'
+
+
+def test_conditional_requests(launch, site):
+    port = launch('web', '--root', site)
+    status, headers, body = get(port, '/index.html')
+    etag, modified = headers['etag'], headers['last-modified']
+    assert get(port, '/index.html', headers=b'If-None-Match: %s\r\n' % (etag.encode()))[0] == 304
+    assert get(port, '/index.html', headers=b'If-None-Match: "other"\r\n')[0] == 200
+    assert get(port, '/index.html', headers=b'If-Modified-Since: %s\r\n' % (modified.encode()))[0] == 304
+    assert get(port, '/index.html', headers=b'If-Modified-Since: Thu, 01 Jan 1970 00:00:00 GMT\r\n')[0] == 200
+
+
+@pytest.mark.parametrize('name', ['index.html', 'big.bin'])
+def test_range_requests(launch, site, name):
+    # the cached small file and the large one sent with sendfile
+    port = launch('web', '--root', site)
+    content = (site / name).read_bytes()
+    status, headers, body = get(port, '/' + name, headers=b'Range: bytes=2-5\r\n')
+    assert (status, body) == (206, content[2:6])
+    assert headers['content-range'] == 'bytes 2-5/%d' % (len(content))
+    assert get(port, '/' + name, headers=b'Range: bytes=-3\r\n')[2] == content[-3:]
+    assert get(port, '/' + name, headers=b'Range: bytes=%d-\r\n' % (len(content)))[0] == 416
+    # a range against an old validator gets the whole file
+    status, headers, body = get(port, '/' + name, headers=b'Range: bytes=2-5\r\nIf-Range: "old"\r\n')
+    assert (status, body) == (200, content)
+
+
+def test_precompressed_variants(launch, site):
+    (site / 'index.html.gz').write_bytes(b'gzipped')
+    port = launch('web', '--root', site)
+    status, headers, body = get(port, '/index.html', headers=b'Accept-Encoding: gzip, deflate\r\n')
+    assert (status, body) == (200, b'gzipped')
+    assert headers['content-encoding'] == 'gzip'
+    assert headers['vary'] == 'Accept-Encoding'
+    assert headers['content-type'].startswith('text/html')
+    status, headers, body = get(port, '/index.html', headers=b'Accept-Encoding: gzip;q=0\r\n')
+    assert (status, body) == (200, b'<h1>index</h1>')
+    assert 'content-encoding' not in headers
+
+
+def test_prefork_workers(launch, site):
+    port = launch('web', '--root', site, '--workers', 3)
+    supervisor = launch.processes[port]
+    deadline = time.time() + 10
+    while len(children(supervisor.pid)) < 3 and time.time() < deadline:
+        time.sleep(0.05)
+    workers = children(supervisor.pid)
+    assert len(workers) == 3
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+        assert set(pool.map(lambda i: get(port, '/index.html')[2], range(60))) == {b'<h1>index</h1>'}
+
+    # a worker that dies is started again
+    os.kill(workers[0], signal.SIGKILL)
+    deadline = time.time() + 10
+    while (workers[0] in children(supervisor.pid) or len(children(supervisor.pid)) < 3) and time.time() < deadline:
+        time.sleep(0.05)
+    assert len(children(supervisor.pid)) == 3
+    assert workers[0] not in children(supervisor.pid)
+    assert [get(port, '/index.html')[0] for i in range(20)] == [200] * 20